@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 
+import contextlib
 import json
+import shlex
+import statistics
 import sys
+import time
 import typing
 import subprocess
 
-from arcaflow_plugin_sdk import plugin
+from arcaflow_plugin_sdk import plugin, schema
 from iperf3_schema import (
     ServerAllParams,
     ServerSuccessOutput,
@@ -13,13 +17,21 @@ from iperf3_schema import (
     ClientInputParams,
     ClientSuccessOutput,
     ClientErrorOutput,
+    ClientOutputCategories,
+    MeshMetric,
+    MeshInputParams,
+    MeshLinkResult,
+    MeshLinkError,
+    MeshOutlier,
+    MeshSuccessOutput,
+    MeshErrorOutput,
     server_input_params_schema,
     client_input_params_schema,
     client_output_categories_schema,
 )
 
 
-def run_iperf3(mode, input_params):
+def iperf3_command(input_params):
     # Set the iperf3 command
     # iperf3_cmd = ["iperf3", f"--{mode}", "--verbose", "--json", "--debug"]
     iperf3_cmd = ["iperf3", "--json"]
@@ -42,6 +54,12 @@ def run_iperf3(mode, input_params):
             if type(value) is not bool:
                 iperf3_cmd.append(f"{value}")
 
+    return iperf3_cmd
+
+
+def run_iperf3(mode, input_params):
+    iperf3_cmd = iperf3_command(input_params)
+
     if mode == "server":
         print()
         # TODO Refactor to run both client and server from function
@@ -139,12 +157,281 @@ def iperf3_client(
     return "success", ClientSuccessOutput(output)
 
 
+def plan_mesh_rounds(
+    host_count: int,
+) -> typing.List[typing.List[typing.Tuple[int, int]]]:
+    # Round k pairs every host i with host (i + k) mod n, so each host sends
+    # exactly once and receives exactly once per round, and all n * (n - 1)
+    # ordered pairs are covered in n - 1 rounds.
+    return [
+        [(sender, (sender + offset) % host_count) for sender in range(host_count)]
+        for offset in range(1, host_count)
+    ]
+
+
+def mesh_round_timeout(params: ClientInputParams) -> typing.Optional[float]:
+    # Runs limited by bytes or blocks have no known duration, so they are
+    # never cut short.
+    if params.bytes is not None or params.blockcount is not None:
+        return None
+    run_time = (params.time if params.time is not None else 10) + (
+        params.omit if params.omit is not None else 0
+    )
+    connect_time = (
+        params.connect_timeout / 1000 if params.connect_timeout is not None else 60
+    )
+    # Leave some room for ssh and for exchanging the results
+    return run_time + connect_time + 30
+
+
+def ssh_command(sender: str, input_params, params: MeshInputParams) -> typing.List[str]:
+    ssh_cmd = ["ssh", "-o", "BatchMode=yes"]
+    if params.ssh_options is not None:
+        ssh_cmd.extend(params.ssh_options)
+    ssh_cmd.append(sender if params.ssh_user is None else f"{params.ssh_user}@{sender}")
+    # ssh hands the command to the remote shell as a single string
+    ssh_cmd.append(shlex.join(iperf3_command(input_params)))
+    return ssh_cmd
+
+
+def run_remote_iperf3(sender: str, input_params, params: MeshInputParams):
+    return subprocess.Popen(
+        ssh_command(sender, input_params, params),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.kill()
+
+
+def mesh_link_result(
+    sender: str, receiver: str, round_index: int, output: ClientOutputCategories
+) -> MeshLinkResult:
+    test_start = output.start.get("test_start", {})
+    if test_start.get("reverse") or test_start.get("bidir"):
+        raise ValueError(
+            "reverse and bidirectional results are not supported in a mesh"
+        )
+
+    end = output.end
+    if test_start.get("protocol") == "UDP":
+        # sum holds the rate the sender offered, so take off the lost
+        # datagrams to get what the receiver got
+        summary = end.get("sum", {})
+        if "bits_per_second" not in summary or "lost_percent" not in summary:
+            raise ValueError("no UDP summary in the client output")
+        bits_per_second = summary["bits_per_second"] * (
+            1 - summary["lost_percent"] / 100
+        )
+    else:
+        summary = end.get("sum_received", {})
+        if "bits_per_second" not in summary:
+            raise ValueError("no throughput summary in the client output")
+        bits_per_second = summary["bits_per_second"]
+    rtts = [
+        stream["sender"]["mean_rtt"]
+        for stream in end.get("streams", [])
+        if "mean_rtt" in stream.get("sender", {})
+    ]
+    return MeshLinkResult(
+        sender=sender,
+        receiver=receiver,
+        round=round_index,
+        bits_per_second=float(bits_per_second),
+        mean_rtt=int(statistics.mean(rtts)) if len(rtts) > 0 else None,
+        retransmits=end.get("sum_sent", {}).get("retransmits"),
+    )
+
+
+def collect_mesh_link(
+    process,
+    sender: str,
+    receiver: str,
+    round_index: int,
+    timeout: typing.Optional[float],
+) -> typing.Union[MeshLinkResult, MeshLinkError]:
+    try:
+        outs, errs = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        return MeshLinkError(sender, receiver, round_index, "timed out")
+
+    # ssh prints warnings on stderr, so only the exit code marks a failure
+    if process.returncode != 0:
+        return MeshLinkError(
+            sender,
+            receiver,
+            round_index,
+            "error ({}):\nstdout:\n{}\nstderr:\n{}".format(
+                process.returncode,
+                outs.decode("utf-8", errors="replace"),
+                errs.decode("utf-8", errors="replace"),
+            ),
+        )
+
+    try:
+        output = client_output_categories_schema.unserialize(
+            json.loads(outs.decode("utf-8"))
+        )
+        return mesh_link_result(sender, receiver, round_index, output)
+    except (
+        AttributeError,
+        KeyError,
+        TypeError,
+        ValueError,
+        schema.ConstraintException,
+    ) as e:
+        return MeshLinkError(
+            sender, receiver, round_index, f"Failed to parse the client output: {e}"
+        )
+
+
+def mesh_outliers(
+    links: typing.List[MeshLinkResult],
+    outlier_ratio: float,
+    outlier_retransmits: int,
+) -> typing.List[MeshOutlier]:
+    outliers = []
+    # The floor keeps a ratio against a median of 0 from flagging every link
+    # with a single retransmit.
+    for metric, attribute, high, floor in (
+        (MeshMetric.throughput, "bits_per_second", False, 0),
+        (MeshMetric.rtt, "mean_rtt", True, 0),
+        (MeshMetric.retransmits, "retransmits", True, outlier_retransmits),
+    ):
+        values = [
+            (link, getattr(link, attribute))
+            for link in links
+            if getattr(link, attribute) is not None
+        ]
+        if len(values) == 0:
+            continue
+        median = float(statistics.median(value for _, value in values))
+        for link, value in values:
+            if high:
+                is_outlier = value * outlier_ratio > median and value >= floor
+            else:
+                is_outlier = value < median * outlier_ratio
+            if is_outlier:
+                outliers.append(
+                    MeshOutlier(
+                        link.sender, link.receiver, metric, float(value), median
+                    )
+                )
+    return outliers
+
+
+@plugin.step(
+    id="mesh",
+    name="iperf3 Mesh",
+    description=(
+        "Runs the iperf3 client over ssh on every host against every other "
+        "host, in concurrent rounds in which each host sends and receives at "
+        "most once, and reports throughput, RTT and retransmit matrices with "
+        "outlier links"
+    ),
+    outputs={"success": MeshSuccessOutput, "error": MeshErrorOutput},
+)
+def iperf3_mesh(
+    params: MeshInputParams,
+) -> typing.Tuple[str, typing.Union[MeshSuccessOutput, MeshErrorOutput]]:
+    hosts = params.hosts
+    if len(set(hosts)) != len(hosts):
+        return "error", MeshErrorOutput(f"Duplicate hosts in mesh: {hosts}")
+
+    client = params.client if params.client is not None else ClientInputParams()
+    if client.bind is not None:
+        return "error", MeshErrorOutput(
+            "bind is not supported in a mesh, each sender uses its own address"
+        )
+    if client.reverse:
+        return "error", MeshErrorOutput(
+            "reverse is not supported in a mesh, data must flow from sender to "
+            "receiver"
+        )
+    base_input_params = client_input_params_schema.serialize(client)
+    round_timeout = mesh_round_timeout(client)
+
+    host_count = len(hosts)
+    rounds = plan_mesh_rounds(host_count)
+    throughput = [[None] * host_count for _ in range(host_count)]
+    rtt = [[None] * host_count for _ in range(host_count)]
+    retransmits = [[None] * host_count for _ in range(host_count)]
+    links = []
+    failed = []
+
+    for round_index, pairs in enumerate(rounds):
+        print(f"==>> Running mesh round {round_index + 1} of {len(rounds)}")
+        deadline = (
+            time.monotonic() + round_timeout if round_timeout is not None else None
+        )
+
+        try:
+            # Kill anything still running and reap every process on the way
+            # out, including when starting a later pair fails.
+            with contextlib.ExitStack() as stack:
+                # Start every client in the round before collecting any of
+                # them so the tests run concurrently.
+                processes = []
+                for sender, receiver in pairs:
+                    input_params = dict(base_input_params)
+                    input_params["host"] = hosts[receiver]
+                    process = stack.enter_context(
+                        run_remote_iperf3(hosts[sender], input_params, params)
+                    )
+                    stack.callback(stop_process, process)
+                    processes.append(process)
+
+                for (sender, receiver), process in zip(pairs, processes):
+                    timeout = (
+                        max(deadline - time.monotonic(), 0)
+                        if deadline is not None
+                        else None
+                    )
+                    link = collect_mesh_link(
+                        process, hosts[sender], hosts[receiver], round_index, timeout
+                    )
+                    if isinstance(link, MeshLinkError):
+                        failed.append(link)
+                        continue
+                    links.append(link)
+                    throughput[sender][receiver] = link.bits_per_second
+                    rtt[sender][receiver] = link.mean_rtt
+                    retransmits[sender][receiver] = link.retransmits
+        except OSError as e:
+            return "error", MeshErrorOutput(f"Failed to start ssh: {e}")
+
+    if len(links) == 0:
+        return "error", MeshErrorOutput(
+            "All mesh links failed:\n"
+            + "\n".join(
+                f"{link.sender} -> {link.receiver}: {link.error}" for link in failed
+            )
+        )
+
+    return "success", MeshSuccessOutput(
+        hosts=hosts,
+        rounds=len(rounds),
+        throughput=throughput,
+        rtt=rtt,
+        retransmits=retransmits,
+        links=links,
+        outliers=mesh_outliers(links, params.outlier_ratio, params.outlier_retransmits),
+        failed=failed,
+    )
+
+
 if __name__ == "__main__":
     sys.exit(
         plugin.run(
             plugin.build_schema(
                 iperf3_server,
                 iperf3_client,
+                iperf3_mesh,
             )
         )
     )
@@ -436,3 +436,226 @@ class ServerErrorOutput:
 @dataclass
 class ClientErrorOutput:
     error: str
+
+
+class MeshMetric(enum.Enum):
+    throughput = "throughput"
+    rtt = "rtt"
+    retransmits = "retransmits"
+
+
+@dataclass
+class MeshInputParams:
+    hosts: typing.Annotated[
+        typing.List[str],
+        schema.name("mesh hosts"),
+        schema.min(2),
+        schema.description(
+            "the hostnames or IP addresses to test between; every host must run "
+            "an iperf3 server and accept ssh connections from this plugin to run "
+            "the iperf3 client"
+        ),
+    ]
+    client: typing.Annotated[
+        typing.Optional[ClientInputParams],
+        schema.name("client parameters"),
+        schema.description(
+            "iperf3 client parameters applied to every link; host is replaced "
+            "by the receiver, and bind and reverse are not supported"
+        ),
+    ] = None
+    ssh_user: typing.Annotated[
+        typing.Optional[str],
+        schema.name("ssh user"),
+        schema.description("user to log in as on the senders"),
+    ] = None
+    ssh_options: typing.Annotated[
+        typing.Optional[typing.List[str]],
+        schema.name("ssh options"),
+        schema.description(
+            "additional ssh arguments, such as an identity file; ssh always runs "
+            "with BatchMode=yes"
+        ),
+    ] = None
+    outlier_ratio: typing.Annotated[
+        typing.Optional[float],
+        schema.name("outlier ratio"),
+        schema.min(0.0),
+        schema.max(1.0),
+        schema.description(
+            "links with a throughput below this fraction of the median, or an "
+            "RTT or retransmit count above the median divided by it, are "
+            "reported as outliers"
+        ),
+    ] = 0.8
+    outlier_retransmits: typing.Annotated[
+        typing.Optional[int],
+        schema.name("outlier retransmits"),
+        schema.min(0),
+        schema.description(
+            "links with fewer retransmits than this are never reported as "
+            "retransmit outliers, since the median is usually 0"
+        ),
+    ] = 10
+
+
+@dataclass
+class MeshLinkResult:
+    sender: typing.Annotated[
+        str,
+        schema.name("sender"),
+        schema.description("the host that ran the iperf3 client"),
+    ]
+    receiver: typing.Annotated[
+        str,
+        schema.name("receiver"),
+        schema.description("the host running the iperf3 server"),
+    ]
+    round: typing.Annotated[
+        int,
+        schema.name("round"),
+        schema.description("the zero-based round the link was tested in"),
+    ]
+    bits_per_second: typing.Annotated[
+        float,
+        schema.name("throughput"),
+        schema.units(unit_bits),
+        schema.description(
+            "bits per second the receiver got; for UDP the offered rate minus "
+            "the lost datagrams"
+        ),
+    ]
+    mean_rtt: typing.Annotated[
+        typing.Optional[int],
+        schema.name("mean RTT"),
+        schema.description("mean RTT across streams in microseconds (TCP only)"),
+    ] = None
+    retransmits: typing.Annotated[
+        typing.Optional[int],
+        schema.name("retransmits"),
+        schema.description("retransmitted segments (TCP only)"),
+    ] = None
+
+
+@dataclass
+class MeshLinkError:
+    sender: typing.Annotated[
+        str,
+        schema.name("sender"),
+        schema.description("the host that ran the iperf3 client"),
+    ]
+    receiver: typing.Annotated[
+        str,
+        schema.name("receiver"),
+        schema.description("the host running the iperf3 server"),
+    ]
+    round: typing.Annotated[
+        int,
+        schema.name("round"),
+        schema.description("the zero-based round the link was tested in"),
+    ]
+    error: typing.Annotated[
+        str,
+        schema.name("error"),
+        schema.description(
+            "why the link has no result, such as the ssh or iperf3 output or a "
+            "timeout"
+        ),
+    ]
+
+
+@dataclass
+class MeshOutlier:
+    sender: typing.Annotated[
+        str,
+        schema.name("sender"),
+        schema.description("the host that ran the iperf3 client"),
+    ]
+    receiver: typing.Annotated[
+        str,
+        schema.name("receiver"),
+        schema.description("the host running the iperf3 server"),
+    ]
+    metric: typing.Annotated[
+        MeshMetric,
+        schema.name("metric"),
+        schema.description(
+            "the metric the link stands out in; low throughput, or high RTT or "
+            "retransmits"
+        ),
+    ]
+    value: typing.Annotated[
+        float,
+        schema.name("value"),
+        schema.description(
+            "the link's value of the metric, in the units of its matrix"
+        ),
+    ]
+    median: typing.Annotated[
+        float,
+        schema.name("median"),
+        schema.description(
+            "the median of the metric across all successful links that report it"
+        ),
+    ]
+
+
+@dataclass
+class MeshSuccessOutput:
+    hosts: typing.Annotated[
+        typing.List[str],
+        schema.name("mesh hosts"),
+        schema.description("the hosts in the row and column order of the matrices"),
+    ]
+    rounds: typing.Annotated[
+        int,
+        schema.name("rounds"),
+        schema.description("the number of rounds the mesh ran in"),
+    ]
+    throughput: typing.Annotated[
+        typing.List[typing.List[typing.Any]],
+        schema.name("throughput matrix"),
+        schema.description(
+            "bits per second the receiver got, indexed [sender][receiver] in "
+            "the order of hosts; null for self and failed links"
+        ),
+    ]
+    rtt: typing.Annotated[
+        typing.List[typing.List[typing.Any]],
+        schema.name("RTT matrix"),
+        schema.description(
+            "mean RTT in microseconds indexed [sender][receiver]; null for self, "
+            "failed and non-TCP links"
+        ),
+    ]
+    retransmits: typing.Annotated[
+        typing.List[typing.List[typing.Any]],
+        schema.name("retransmits matrix"),
+        schema.description(
+            "retransmits indexed [sender][receiver]; null for self, failed and "
+            "non-TCP links"
+        ),
+    ]
+    links: typing.Annotated[
+        typing.List[MeshLinkResult],
+        schema.name("links"),
+        schema.description("the result of every link that was measured"),
+    ]
+    outliers: typing.Annotated[
+        typing.List[MeshOutlier],
+        schema.name("outliers"),
+        schema.description(
+            "links whose throughput is below outlier ratio times the median, or "
+            "whose RTT or retransmits are above the median divided by it"
+        ),
+    ]
+    failed: typing.Annotated[
+        typing.List[MeshLinkError],
+        schema.name("failed links"),
+        schema.description("links that did not produce a result"),
+    ]
+
+
+@dataclass
+class MeshErrorOutput:
+    error: str
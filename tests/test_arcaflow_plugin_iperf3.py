@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
+import json
+import subprocess
+import sys
+import time
 from time import sleep
 import unittest
+from unittest import mock
 import iperf3_plugin
 import iperf3_schema
 from multiprocessing.pool import ThreadPool
@@ -18,6 +23,57 @@ def run_iperf3_server():
     return iperf3_plugin.iperf3_server(params=server_input, run_id="plugin_server_ci")
 
 
+def tcp_output(bits_per_second, mean_rtt, retransmits):
+    return {
+        "start": {"test_start": {"protocol": "TCP", "reverse": 0}},
+        "intervals": [],
+        "end": {
+            "streams": [{"sender": {"mean_rtt": mean_rtt}}],
+            "sum_sent": {
+                "bits_per_second": bits_per_second * 1.01,
+                "retransmits": retransmits,
+            },
+            "sum_received": {"bits_per_second": bits_per_second},
+        },
+    }
+
+
+def udp_output(bits_per_second, lost_percent):
+    return {
+        "start": {"test_start": {"protocol": "UDP", "reverse": 0}},
+        "intervals": [],
+        "end": {
+            "streams": [{"udp": {"bits_per_second": bits_per_second}}],
+            "sum": {"bits_per_second": bits_per_second, "lost_percent": lost_percent},
+        },
+    }
+
+
+def fake_sender(output, delay=0):
+    # Stands in for ssh: a local process that waits, then prints the canned
+    # iperf3 output, or fails like iperf3 does when it gets a string.
+    if isinstance(output, str):
+        script = "import sys; sys.stderr.write(sys.argv[2]); sys.exit(1)"
+    else:
+        script = (
+            "import sys, time; time.sleep(float(sys.argv[1])); "
+            "sys.stdout.write(sys.argv[2])"
+        )
+        output = json.dumps(output)
+    return subprocess.Popen(
+        [sys.executable, "-c", script, str(delay), output],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+def fake_remote_iperf3(outputs, delay=0):
+    def run_remote_iperf3(sender, input_params, params):
+        return fake_sender(outputs[(sender, input_params["host"])], delay)
+
+    return run_remote_iperf3
+
+
 class iperf3Test(unittest.TestCase):
     @staticmethod
     def test_serialization():
@@ -43,6 +99,298 @@ class iperf3Test(unittest.TestCase):
             iperf3_plugin.ClientErrorOutput(error="This is an error")
         )
 
+        plugin.test_object_serialization(
+            iperf3_plugin.MeshInputParams(
+                hosts=["foo", "bar", "baz"],
+                client=iperf3_schema.ClientInputParams(port=50000, time=5),
+                ssh_user="root",
+                ssh_options=["-i", "/keys/id_rsa"],
+                outlier_ratio=0.5,
+            )
+        )
+
+        plugin.test_object_serialization(
+            iperf3_plugin.MeshSuccessOutput(
+                hosts=["foo", "bar"],
+                rounds=1,
+                throughput=[[None, 100.0], [None, None]],
+                rtt=[[None, 20], [None, None]],
+                retransmits=[[None, 1], [None, None]],
+                links=[
+                    iperf3_plugin.MeshLinkResult(
+                        sender="foo",
+                        receiver="bar",
+                        round=0,
+                        bits_per_second=100.0,
+                        mean_rtt=20,
+                        retransmits=1,
+                    )
+                ],
+                outliers=[
+                    iperf3_plugin.MeshOutlier(
+                        sender="foo",
+                        receiver="bar",
+                        metric=iperf3_schema.MeshMetric.retransmits,
+                        value=50.0,
+                        median=2.0,
+                    )
+                ],
+                failed=[
+                    iperf3_plugin.MeshLinkError(
+                        sender="bar",
+                        receiver="foo",
+                        round=0,
+                        error="This is an error",
+                    )
+                ],
+            )
+        )
+
+    def test_plan_mesh_rounds(self):
+        host_count = 5
+        rounds = iperf3_plugin.plan_mesh_rounds(host_count)
+
+        self.assertEqual(host_count - 1, len(rounds))
+        for pairs in rounds:
+            senders = [sender for sender, _ in pairs]
+            receivers = [receiver for _, receiver in pairs]
+            self.assertEqual(len(set(senders)), len(senders))
+            self.assertEqual(len(set(receivers)), len(receivers))
+            self.assertNotIn(True, [sender == receiver for sender, receiver in pairs])
+
+        all_pairs = [pair for pairs in rounds for pair in pairs]
+        self.assertEqual(len(set(all_pairs)), len(all_pairs))
+        self.assertEqual(host_count * (host_count - 1), len(all_pairs))
+
+    def test_ssh_command(self):
+        self.assertEqual(
+            [
+                "ssh",
+                "-o",
+                "BatchMode=yes",
+                "-i",
+                "/keys/id_rsa",
+                "root@a",
+                "iperf3 --json --port 50000 --client b --title 'rack 1'",
+            ],
+            iperf3_plugin.ssh_command(
+                "a",
+                {"port": 50000, "host": "b", "title": "rack 1"},
+                iperf3_schema.MeshInputParams(
+                    hosts=["a", "b"],
+                    ssh_user="root",
+                    ssh_options=["-i", "/keys/id_rsa"],
+                ),
+            ),
+        )
+
+    def test_mesh_round_timeout(self):
+        self.assertEqual(
+            100,
+            iperf3_plugin.mesh_round_timeout(iperf3_schema.ClientInputParams()),
+        )
+        self.assertEqual(
+            42,
+            iperf3_plugin.mesh_round_timeout(
+                iperf3_schema.ClientInputParams(time=5, omit=2, connect_timeout=5000)
+            ),
+        )
+        self.assertIsNone(
+            iperf3_plugin.mesh_round_timeout(iperf3_schema.ClientInputParams(bytes=100))
+        )
+
+    def test_mesh(self):
+        outputs = {
+            ("a", "b"): tcp_output(1000.0, 100, 0),
+            ("a", "c"): tcp_output(1000.0, 100, 0),
+            ("b", "a"): tcp_output(1000.0, 100, 0),
+            # Slow link with a high RTT and retransmits
+            ("b", "c"): tcp_output(100.0, 500, 20),
+            # 10% of the datagrams are lost on the way
+            ("c", "a"): udp_output(1000.0, 10),
+            ("c", "b"): "iperf3: error - unable to connect to server",
+        }
+
+        start = time.monotonic()
+        with mock.patch.object(
+            iperf3_plugin, "run_remote_iperf3", fake_remote_iperf3(outputs, 0.5)
+        ):
+            output_id, output_data = iperf3_plugin.iperf3_mesh(
+                params=iperf3_schema.MeshInputParams(hosts=["a", "b", "c"]),
+                run_id="plugin_mesh_ci",
+            )
+        # Two rounds of three concurrent pairs, not six sequential runs
+        self.assertLess(time.monotonic() - start, 2.5)
+
+        self.assertEqual("success", output_id)
+        self.assertEqual(2, output_data.rounds)
+        self.assertEqual(
+            [
+                [None, 1000.0, 1000.0],
+                [1000.0, None, 100.0],
+                [900.0, None, None],
+            ],
+            output_data.throughput,
+        )
+        self.assertEqual(
+            [[None, 100, 100], [100, None, 500], [None, None, None]],
+            output_data.rtt,
+        )
+        self.assertEqual(
+            [[None, 0, 0], [0, None, 20], [None, None, None]],
+            output_data.retransmits,
+        )
+        self.assertEqual(5, len(output_data.links))
+        self.assertEqual(
+            [
+                ("b", "c", iperf3_schema.MeshMetric.throughput),
+                ("b", "c", iperf3_schema.MeshMetric.rtt),
+                ("b", "c", iperf3_schema.MeshMetric.retransmits),
+            ],
+            [
+                (outlier.sender, outlier.receiver, outlier.metric)
+                for outlier in output_data.outliers
+            ],
+        )
+        self.assertEqual(
+            [("c", "b", 1)],
+            [(link.sender, link.receiver, link.round) for link in output_data.failed],
+        )
+        self.assertIn("unable to connect", output_data.failed[0].error)
+
+    def test_mesh_link_result_udp_loss(self):
+        output = iperf3_schema.ClientOutputCategories(**udp_output(1000.0, 75))
+        link = iperf3_plugin.mesh_link_result("a", "b", 0, output)
+        self.assertEqual(250.0, link.bits_per_second)
+        self.assertIsNone(link.mean_rtt)
+        self.assertIsNone(link.retransmits)
+
+    def test_mesh_outliers(self):
+        def links(retransmits):
+            return [
+                iperf3_schema.MeshLinkResult(
+                    sender="a",
+                    receiver=receiver,
+                    round=0,
+                    bits_per_second=1000.0,
+                    mean_rtt=100,
+                    retransmits=value,
+                )
+                for receiver, value in zip("bcde", retransmits)
+            ]
+
+        # A median of 0 alone does not turn a single retransmit into an outlier
+        self.assertEqual([], iperf3_plugin.mesh_outliers(links([0, 0, 1, 0]), 0.8, 10))
+
+        outliers = iperf3_plugin.mesh_outliers(links([0, 0, 50, 0]), 0.8, 10)
+        self.assertEqual(
+            [("d", iperf3_schema.MeshMetric.retransmits, 50.0, 0.0)],
+            [
+                (outlier.receiver, outlier.metric, outlier.value, outlier.median)
+                for outlier in outliers
+            ],
+        )
+
+        self.assertEqual(
+            ["d"],
+            [
+                outlier.receiver
+                for outlier in iperf3_plugin.mesh_outliers(links([0, 0, 1, 0]), 0.8, 0)
+            ],
+        )
+
+    def test_mesh_timeout(self):
+        outputs = {
+            ("a", "b"): tcp_output(1000.0, 100, 0),
+            ("b", "a"): tcp_output(1000.0, 100, 0),
+        }
+
+        def run_remote_iperf3(sender, input_params, params):
+            if sender == "b":
+                return subprocess.Popen(
+                    [sys.executable, "-c", "import time; time.sleep(30)"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+            return fake_sender(outputs[(sender, input_params["host"])])
+
+        start = time.monotonic()
+        with mock.patch.object(
+            iperf3_plugin, "run_remote_iperf3", run_remote_iperf3
+        ), mock.patch.object(iperf3_plugin, "mesh_round_timeout", lambda _: 1):
+            output_id, output_data = iperf3_plugin.iperf3_mesh(
+                params=iperf3_schema.MeshInputParams(hosts=["a", "b"]),
+                run_id="plugin_mesh_ci",
+            )
+        self.assertLess(time.monotonic() - start, 10)
+
+        self.assertEqual("success", output_id)
+        self.assertEqual([[None, 1000.0], [None, None]], output_data.throughput)
+        self.assertEqual(
+            [("b", "a", "timed out")],
+            [(link.sender, link.receiver, link.error) for link in output_data.failed],
+        )
+
+    def test_mesh_failed_links(self):
+        reverse = tcp_output(1000.0, 100, 0)
+        reverse["start"]["test_start"]["reverse"] = 1
+
+        with mock.patch.object(
+            iperf3_plugin,
+            "run_remote_iperf3",
+            fake_remote_iperf3(
+                {("a", "b"): reverse, ("b", "a"): {"start": {}, "intervals": []}}
+            ),
+        ):
+            output_id, output_data = iperf3_plugin.iperf3_mesh(
+                params=iperf3_schema.MeshInputParams(hosts=["a", "b"]),
+                run_id="plugin_mesh_ci",
+            )
+        self.assertEqual("error", output_id)
+        self.assertIn("a -> b: Failed to parse", output_data.error)
+        self.assertIn("b -> a: Failed to parse", output_data.error)
+
+        started = []
+
+        def run_remote_iperf3(sender, input_params, params):
+            # The first pair of the round starts, the second cannot
+            if len(started) > 0:
+                raise FileNotFoundError("ssh")
+            started.append(
+                subprocess.Popen(
+                    [sys.executable, "-c", "import time; time.sleep(30)"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+            )
+            return started[0]
+
+        with mock.patch.object(iperf3_plugin, "run_remote_iperf3", run_remote_iperf3):
+            output_id, output_data = iperf3_plugin.iperf3_mesh(
+                params=iperf3_schema.MeshInputParams(hosts=["a", "b"]),
+                run_id="plugin_mesh_ci",
+            )
+        self.assertEqual("error", output_id)
+        self.assertIn("Failed to start ssh", output_data.error)
+        self.assertIsNotNone(started[0].returncode)
+
+        for client in (
+            iperf3_schema.ClientInputParams(reverse=True),
+            iperf3_schema.ClientInputParams(bind="10.0.0.1"),
+        ):
+            output_id, _ = iperf3_plugin.iperf3_mesh(
+                params=iperf3_schema.MeshInputParams(hosts=["a", "b"], client=client),
+                run_id="plugin_mesh_ci",
+            )
+            self.assertEqual("error", output_id)
+
+        output_id, output_data = iperf3_plugin.iperf3_mesh(
+            params=iperf3_schema.MeshInputParams(hosts=["a", "b", "a"]),
+            run_id="plugin_mesh_ci",
+        )
+        self.assertEqual("error", output_id)
+        self.assertIn("Duplicate hosts", output_data.error)
+
     def test_functional(self):
         pool = ThreadPool(processes=1)
 